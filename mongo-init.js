@@ -22,6 +22,7 @@ db.createCollection('books', {
         goodreads_book_id: { bsonType: "long" },
         title: { bsonType: "string" },
         authors: { bsonType: "string" },
+        authors_lc: { bsonType: "string" },
         original_publication_year: { bsonType: "long" },
         average_rating: { bsonType: "double" },
         ratings_count: { bsonType: "long" },
@@ -53,7 +54,8 @@ db.createCollection('tags', {
       required: ["tag_id", "tag_name"],
       properties: {
         tag_id: { bsonType: "long" },
-        tag_name: { bsonType: "string" }
+        tag_name: { bsonType: "string" },
+        book_count: { bsonType: ["int", "long"] }
       }
     }
   }
@@ -67,7 +69,8 @@ db.createCollection('book_tags', {
       properties: {
         goodreads_book_id: { bsonType: "long" },
         tag_id: { bsonType: "long" },
-        count: { bsonType: "long" }
+        count: { bsonType: "long" },
+        tag_name: { bsonType: ["string", "null"] }
       }
     }
   }
@@ -90,11 +93,12 @@ db.createCollection('to_read', {
 db.books.createIndex({ "book_id": 1 }, { unique: true });
 db.books.createIndex({ "goodreads_book_id": 1 });
 db.books.createIndex({ "title": "text", "authors": "text" });
+db.books.createIndex({ "authors_lc": 1 });
 db.books.createIndex({ "average_rating": 1 });
 db.books.createIndex({ "original_publication_year": 1 });
 
 db.ratings.createIndex({ "user_id": 1, "book_id": 1 }, { unique: true });
-db.ratings.createIndex({ "book_id": 1 });
+db.ratings.createIndex({ "book_id": 1, "rating": 1 });
 db.ratings.createIndex({ "user_id": 1 });
 
 db.tags.createIndex({ "tag_id": 1 }, { unique: true });
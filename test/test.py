@@ -0,0 +1,51 @@
+import base64
+
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from app.main import decode_cursor, encode_cursor
+
+
+def raw_cursor(*parts):
+    return base64.urlsafe_b64encode(orjson.dumps(list(parts))).decode()
+
+
+@pytest.mark.parametrize("value", [4.25, 1997, "Animal Farm", None])
+def test_cursor_round_trip(value):
+    cursor = encode_cursor("avg", "desc", value, 170)
+    assert decode_cursor(cursor, "avg", "desc") == (value, 170)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    raw_cursor("avg", "desc", 1),
+    raw_cursor({"a": 1}),
+])
+def test_decode_cursor_rejects_malformed(cursor):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, "avg", "desc")
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("value", [{"$regex": "(a+)+$"}, {"$foo": 1}, [1, 2], True])
+def test_decode_cursor_rejects_non_scalar_values(value):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(raw_cursor("title", "asc", value, 1), "title", "asc")
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("book_id", ["1", 1.5, None, True])
+def test_decode_cursor_rejects_bad_book_id(book_id):
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(raw_cursor("avg", "desc", 4.0, book_id), "avg", "desc")
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("sort,order", [("avg", "desc"), ("title", "asc")])
+def test_decode_cursor_rejects_other_sort(sort, order):
+    cursor = encode_cursor("title", "desc", "Animal Farm", 170)
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor(cursor, sort, order)
+    assert exc.value.status_code == 400